@@ -8,57 +8,145 @@ Thangs scraper (Playwright) – genérico para cualquier listado con enlaces a /
   (con fallback global si no aparece ese bloque)
 - Normalización básica de nombres de modelo y colores
 - CSVs: models_colors.csv, color_counts.csv
-- Artefactos de depuración en ./debug/
+- Artefactos de depuración en ./debug/ (con THANGS_DEBUG=1)
 """
 
+import asyncio
 import csv
+import io
 import os
 import re
+import sqlite3
 import sys
 import time
+from collections import defaultdict
 from pathlib import Path
 from urllib.parse import urljoin
 
-from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright, TimeoutError as PwTimeout
+import httpx
+import lxml.etree
+import lxml.html
+from playwright.async_api import async_playwright, TimeoutError as PwTimeout
 
 # ---------- Config ----------
-DEBUG_DIR = Path("debug"); DEBUG_DIR.mkdir(exist_ok=True)
+# Artefactos de depuración (screenshot + HTML) solo con THANGS_DEBUG=1
+DEBUG = os.getenv("THANGS_DEBUG") == "1"
+DEBUG_DIR = Path("debug")
+
+# Fichas abiertas a la vez en el navegador (pestañas del mismo contexto)
+CONCURRENCY = max(1, int(os.getenv("THANGS_CONCURRENCY", "6")))
+
+# Ritmo máximo de peticiones a thangs.com (HEAD/GET HTTP y navegaciones Playwright;
+# por segundo entre todas las tareas; 0 = sin límite)
+RATE = float(os.getenv("THANGS_RATE", "3"))
+
+# Peticiones/conexiones simultáneas del cliente HTTP/2 (fichas servidas sin navegador)
+HTTP_CONNECTIONS = 20
+
+# Espera máxima (ms) a que aparezca el contenido buscado tras navegar (sin esperas fijas):
+# enlaces de un listado, o texto Polymaker en una ficha (tope corto: muchas no lo tienen)
+CONTENT_WAIT_MS = 5000
+POLY_WAIT_MS = 1200
+
+# Scroll infinito: presupuesto total (s) y espera máxima (ms) a que la página crezca
+SCROLL_BUDGET_S = 30
+SCROLL_WAIT_MS = 2500
+
+# Caché persistente url → (ETag/Last-Modified, título, colores) entre ejecuciones
+CACHE_PATH = Path(os.getenv("THANGS_CACHE", ".thangs_cache.sqlite3"))
+# Entradas más recientes que esto se reutilizan sin tocar la red (ni HEAD)
+CACHE_TTL_S = float(os.getenv("THANGS_CACHE_TTL_DAYS", "7")) * 86400
+
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+              "AppleWebKit/537.36 (KHTML, like Gecko) "
+              "Chrome/128.0.0.0 Safari/537.36")
+
+# Recursos que no hacen falta para leer el DOM: imágenes, fuentes, vídeo, CSS y analítica.
+# Se bloquean por URL o, para lo que el patrón no reconoce (p.ej. /img/abc123?format=webp),
+# por tipo de recurso; ambos se comprueban en el mismo handler de new_context.
+BLOCKED_URL_RE = re.compile(
+    r"\.(?:png|jpe?g|webp|gif|svg|ico|avif|woff2?|ttf|otf|mp4|webm|css)\b|/_next/image\b"
+    r"|google-analytics|googletagmanager|doubleclick|facebook\.net|hotjar|segment\.io",
+    re.IGNORECASE
+)
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+
+BASE_URL = "https://thangs.com"
 
 # Enlaces de modelos (cualquier diseñador/colección)
 MODEL_LINK_RE = re.compile(r"/designer/[^/]+/3d-model/[^?\s]+-\d+$", re.IGNORECASE)
 
-# Encabezado de bloque Polymaker
-HEADER_RE = re.compile(
-    r"(Want your.*?Shop the filament we used on the Polymaker Website|Shop the filament we used on the Polymaker Website)",
-    re.IGNORECASE | re.DOTALL
+# hrefs candidatos a modelo (el filtro grueso se resuelve en libxml2)
+_ANCHOR_XPATH = lxml.etree.XPath("//a[contains(@href,'/3d-model/')]/@href")
+
+# Mismo filtro, pero ejecutado en el DOM vivo (evita serializar y re-parsear la página)
+_ANCHOR_SELECTOR = 'a[href*="/3d-model/"]'
+_HREFS_JS = "els => els.map(e => e.getAttribute('href'))"
+
+# Baja al final y devuelve la altura previa (para esperar a que crezca)
+_SCROLL_JS = ("() => { const h = document.body.scrollHeight;"
+              " window.scrollTo(0, h); return h; }")
+_GREW_JS = "h => document.body.scrollHeight > h"
+
+# Encabezado de bloque Polymaker ("Want your ... Shop the filament we used on the
+# Polymaker Website" o solo la segunda frase): basta con buscar el literal común
+HEADER_PHRASE = "shop the filament we used on the polymaker website"
+
+# Texto que no se ve: scripts (p.ej. el JSON de __NEXT_DATA__, con otros modelos), estilos...
+_NOT_HIDDEN = "not(ancestor::script or ancestor::style or ancestor::template or ancestor::noscript)"
+
+# Nodo de texto del encabezado
+_HEADER_XPATH = lxml.etree.XPath(
+    "//text()[contains(translate(., 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'),"
+    f" '{HEADER_PHRASE}')][{_NOT_HIDDEN}]"
+)
+
+# Texto visible del body para el fallback global (como get_text de BeautifulSoup)
+_BODY_TEXT_XPATH = lxml.etree.XPath(f"//body//text()[{_NOT_HIDDEN}]")
+_BLOCK_TAGS = ("section", "div", "article", "main")
+
+# Elementos del bloque Polymaker (límites por posición resueltos en libxml2):
+# estricto = anchors entre los primeros 80 a/li/p/div/span; relajado = primeros 120 li/p/div/span
+_BLOCK_ANCHORS_XPATH = lxml.etree.XPath(
+    "descendant::*[self::a or self::li or self::p or self::div or self::span]"
+    "[position() <= 80][self::a]"
+)
+_BLOCK_TEXTS_XPATH = lxml.etree.XPath(
+    "descendant::*[self::li or self::p or self::div or self::span][position() <= 120]"
 )
 
+# Título de la ficha: primer h1/title en orden de documento
+_TITLE_XPATH = lxml.etree.XPath("(//h1 | //title)[1]")
+
 # Coincide con cualquier acabado (Matte, Silk, Glossy, Galaxy...) hasta PLA
 POLY_ITEM_RE = re.compile(
     r"Polymaker\s+([A-Za-z]+(?:\s+[A-Za-z]+)*?)\s+PLA\b", re.IGNORECASE
 )
 
-# También para fallback global
-POLY_LINE_RE = POLY_ITEM_RE
-
 POLY_DOMAIN_RE = re.compile(
     r"https?://([a-z0-9\-]+\.)*polymaker\.com\b", re.IGNORECASE
 )
 
+# Limpieza de títulos/colores (compiladas una sola vez)
+_RE_GREY = re.compile(r"\bGrey\b", re.IGNORECASE)
+_RE_NOSUPPORT = re.compile(r"\s*\(No Support.*$")
+
 # ---------- Utilidades ----------
-def dump_debug(page, name: str):
-    """Guarda screenshot y HTML para analizar fallos."""
+async def dump_debug(page, name: str):
+    """Guarda screenshot (solo viewport) y HTML para analizar fallos, si DEBUG."""
+    if not DEBUG:
+        return
+    DEBUG_DIR.mkdir(exist_ok=True)
     try:
-        page.screenshot(path=str(DEBUG_DIR / f"{name}.png"), full_page=True)
+        await page.screenshot(path=str(DEBUG_DIR / f"{name}.png"), full_page=False)
     except Exception:
         pass
     try:
-        (DEBUG_DIR / f"{name}.html").write_text(page.content(), encoding="utf-8")
+        (DEBUG_DIR / f"{name}.html").write_text(await page.content(), encoding="utf-8")
     except Exception:
         pass
 
-def safe_goto(page, url: str, label: str = "page", attempts: int = 3):
+async def safe_goto(page, url: str, label: str = "page", attempts: int = 3):
     """
     Navega con estrategias progresivas evitando 'networkidle' (fragil en Thangs).
     1) domcontentloaded
@@ -71,94 +159,134 @@ def safe_goto(page, url: str, label: str = "page", attempts: int = 3):
         state = states[min(i, len(states)-1)]
         try:
             if state:
-                page.goto(url, wait_until=state, timeout=60000)
+                await page.goto(url, wait_until=state, timeout=60000)
             else:
-                page.goto(url, timeout=60000)
-                page.wait_for_timeout(1500)
+                await page.goto(url, timeout=60000)
+                await page.wait_for_timeout(1500)
             return True
         except PwTimeout as e:
             last_err = e
-    dump_debug(page, f"{label}_goto_fail")
+    await dump_debug(page, f"{label}_goto_fail")
     raise last_err or RuntimeError(f"Failed to goto {url}")
 
-def collect_links_from_html(html: str):
-    """Devuelve set de URLs absolutas a modelos encontradas en el HTML."""
-    soup = BeautifulSoup(html, "lxml")
-    urls = set()
-
-    # Preferido: patrón completo /designer/<slug>/3d-model/<slug>-<id>
-    for a in soup.find_all("a", href=True):
-        href = a["href"] or ""
-        if MODEL_LINK_RE.search(href):
-            urls.add(urljoin("https://thangs.com", href))
+# HTMLParser reutilizado, sin índice de ids ni comentarios. Los nodos de texto en
+# blanco se conservan: separan palabras entre elementos inline al extraer texto.
+_PARSER = lxml.html.HTMLParser(collect_ids=False, remove_comments=True, huge_tree=True)
+
+def _absolute_url(href: str) -> str:
+    """URL absoluta en thangs.com; urljoin solo para rutas que no sean triviales."""
+    if href.startswith(("https://", "http://")):
+        return href
+    if href.startswith("/") and not href.startswith("//"):
+        return BASE_URL + href
+    return urljoin(BASE_URL, href)
+
+def model_urls_from_hrefs(hrefs):
+    """Filtra hrefs con /3d-model/ y devuelve set de URLs absolutas a modelos."""
+    urls, fallback = set(), set()
+    search = MODEL_LINK_RE.search
+    for href in hrefs:
+        if not href:
+            continue
+        # Preferido: patrón completo /designer/<slug>/3d-model/<slug>-<id>
+        if search(href):
+            urls.add(_absolute_url(href))
+        # Fallback: cualquier /3d-model/ (por si cambia el layout)
+        elif "/3d-model/" in href:
+            fallback.add(href)
 
-    # Fallback: cualquier /3d-model/ (por si cambia el layout)
     if not urls:
-        for a in soup.find_all("a", href=True):
-            href = a["href"] or ""
-            if "/3d-model/" in href:
-                urls.add(urljoin("https://thangs.com", href))
-
+        urls = {_absolute_url(h) for h in fallback}
     return urls
 
-def discover_model_urls_scroll(page, listing_url: str):
+def collect_links_from_html(html: str):
+    """Devuelve set de URLs absolutas a modelos encontradas en el HTML."""
+    try:
+        hrefs = _ANCHOR_XPATH(lxml.html.fromstring(html, parser=_PARSER))
+    except (lxml.etree.ParserError, ValueError):
+        return set()
+    return model_urls_from_hrefs(hrefs)
+
+async def discover_model_urls_scroll(page, listing_url: str):
     """Hace scroll infinito e intenta descubrir enlaces a modelos."""
-    urls = set()
+    hrefs = set()
     print("[*] Intentando scroll infinito…")
 
     # Evitar networkidle
-    safe_goto(page, listing_url, label="designer")
+    await safe_goto(page, listing_url, label="designer")
 
     # Algún anchor de /3d-model/ como señal inicial
     try:
-        page.wait_for_selector('a[href*="/3d-model/"]', timeout=15000)
+        await page.wait_for_selector(_ANCHOR_SELECTOR, timeout=15000)
     except PwTimeout:
         print("[!] No hay enlaces visibles inmediatos; seguimos con scroll + dump")
-        dump_debug(page, "designer_initial")
-
-    last_height = 0
-    stagnant = 0
-    for _ in range(40):
-        html = page.content()
-        urls |= collect_links_from_html(html)
+        await dump_debug(page, "designer_initial")
 
+    async def collect():
         try:
-            page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+            hrefs.update(await page.eval_on_selector_all(_ANCHOR_SELECTOR, _HREFS_JS))
         except Exception:
             pass
-        page.wait_for_timeout(900)
 
+    # Sin número fijo de vueltas: se corta por presupuesto de tiempo o por estancamiento
+    deadline = time.monotonic() + SCROLL_BUDGET_S
+    stagnant = 0
+    while time.monotonic() < deadline:
+        seen = len(hrefs)
+        await collect()
+        new_links = len(hrefs) > seen
+
+        # Se sigue en cuanto la página crece, sin dormir un tiempo fijo
+        grew = False
         try:
-            height = page.evaluate("document.body.scrollHeight")
+            height = await page.evaluate(_SCROLL_JS)
+            await page.wait_for_function(_GREW_JS, arg=height, timeout=SCROLL_WAIT_MS)
+            grew = True
+        except PwTimeout:
+            pass
         except Exception:
-            height = last_height
+            await page.wait_for_timeout(300)
 
-        if height == last_height:
-            stagnant += 1
-        else:
+        # Sin enlaces nuevos ni crecimiento de la página durante 2 vueltas: fin
+        if grew or new_links:
             stagnant = 0
-        last_height = height
-
-        if stagnant >= 4:
+        else:
+            stagnant += 1
+        if stagnant >= 2:
             break
+    else:
+        # Agotado el presupuesto tras un último crecimiento: recoger lo que cargó
+        await collect()
+
+    urls = model_urls_from_hrefs(hrefs)
+    if not urls:
+        # Red de seguridad: un único parseo del HTML final
+        urls = collect_links_from_html(await page.content())
 
     print(f"[*] Scroll recogió {len(urls)} enlaces")
     if not urls:
-        dump_debug(page, "designer_after_scroll")
+        await dump_debug(page, "designer_after_scroll")
     return sorted(urls)
 
-def discover_model_urls_paged(page, listing_url: str, max_pages: int = 20):
+async def discover_model_urls_paged(page, listing_url: str, max_pages: int = 20):
     """Plan B: si hay paginación ?page=N, recorre hasta que no encuentre más."""
     print("[*] Intentando paginación ?page=N…")
     urls = set()
     for n in range(1, max_pages + 1):
         url = listing_url if n == 1 else f"{listing_url}?page={n}"
         try:
-            page.goto(url, wait_until="domcontentloaded", timeout=60000)
+            await page.goto(url, wait_until="domcontentloaded", timeout=60000)
+        except PwTimeout:
+            await page.goto(url, wait_until="load", timeout=60000)
+        try:
+            await page.wait_for_selector(_ANCHOR_SELECTOR, timeout=CONTENT_WAIT_MS)
         except PwTimeout:
-            page.goto(url, wait_until="load", timeout=60000)
-        page.wait_for_timeout(1000)
-        found = collect_links_from_html(page.content())
+            pass
+        try:
+            found = model_urls_from_hrefs(
+                await page.eval_on_selector_all(_ANCHOR_SELECTOR, _HREFS_JS))
+        except Exception:
+            found = collect_links_from_html(await page.content())
         print(f"    - page {n}: {len(found)} enlaces")
         urls |= found
         if not found:
@@ -166,138 +294,529 @@ def discover_model_urls_paged(page, listing_url: str, max_pages: int = 20):
     print(f"[*] Paginación recogió {len(urls)} enlaces")
     return sorted(urls)
 
-def _extract_from_poly_block_strict(soup: BeautifulSoup):
-    """Solo anchors que apunten a polymaker.com dentro del bloque Polymaker."""
-    header_node = soup.find(string=HEADER_RE)
-    if not header_node:
-        return []
-
-    container = header_node.find_parent(["section", "div", "article", "main"]) or header_node.parent
-    colors, seen = [], set()
-
-    for tag in container.find_all(["a", "li", "p", "div", "span"], limit=80):
-        if tag.name in ("h1", "h2", "h3", "hr"):
-            break
-        if tag.name == "a":
-            href = (tag.get("href") or "").strip()
-            if POLY_DOMAIN_RE.search(href):
-                txt = tag.get_text(" ", strip=True)
-                for m in POLY_ITEM_RE.findall(txt):
-                    color = m.strip()
-                    key = color.lower()
-                    if key not in seen and len(color.split()) >= 2:
-                        seen.add(key)
-                        colors.append(color)
-    return colors
-
-
-def _extract_from_poly_block_relaxed(soup: BeautifulSoup):
-    """Fallback: mismo bloque, acepta texto 'Polymaker ... PLA' sin requerir enlaces."""
-    header_node = soup.find(string=HEADER_RE)
-    if not header_node:
-        return []
+def _text(el, sep: str = " ") -> str:
+    """Texto del elemento: fragmentos no vacíos, sin espacios sobrantes, unidos con sep."""
+    return sep.join(t for t in (t.strip() for t in el.itertext()) if t)
+
+def _has_poly_header(html: str) -> bool:
+    """Prefiltro por substring (sin regex) de la frase del encabezado Polymaker."""
+    return HEADER_PHRASE in html.lower()
+
+def _find_poly_container(doc):
+    """Ancestro section/div/article/main más cercano al encabezado Polymaker."""
+    hits = _HEADER_XPATH(doc)
+    if not hits:
+        return None
+    node = hits[0].getparent()
+    if hits[0].is_tail:
+        node = node.getparent()
+    if node is None or node.tag in _BLOCK_TAGS:
+        return node
+    return next(node.iterancestors(*_BLOCK_TAGS), node)
+
+def _find_poly_items(text: str):
+    """
+    Igual que POLY_ITEM_RE.findall(text), pero el texto se recorre una sola vez con
+    str.find buscando el literal 'polymaker' y el regex solo se prueba en esas posiciones
+    (con IGNORECASE el motor de re no puede saltar por prefijo literal).
+    """
+    lower = text.lower()
+    if len(lower) != len(text):
+        # lower() cambió offsets (unicode raro): camino clásico
+        return POLY_ITEM_RE.findall(text)
+
+    found = []
+    pos = lower.find("polymaker")
+    while pos != -1:
+        m = POLY_ITEM_RE.match(text, pos)
+        if m:
+            found.append(m.group(1))
+            pos = lower.find("polymaker", m.end())
+        else:
+            pos = lower.find("polymaker", pos + 1)
+    return found
 
-    container = header_node.find_parent(["section", "div", "article", "main"]) or header_node.parent
+def _poly_items(texts):
+    """
+    Colores 'Polymaker ... PLA' de una lista de textos, ya normalizados (espacios
+    colapsados, Grey → Gray), con ≥2 palabras y sin duplicados. El grupo de
+    POLY_ITEM_RE solo admite letras y espacios, así que no queda puntuación que recortar.
+    """
     colors, seen = [], set()
-
-    for tag in container.find_all(["li", "p", "div", "span"], limit=120):
-        if tag.name in ("h1", "h2", "h3", "hr"):
-            break
-        txt = tag.get_text(" ", strip=True)
-        for m in POLY_ITEM_RE.findall(txt):
-            color = m.strip()
+    for txt in texts:
+        for m in _find_poly_items(txt):
+            words = m.split()
+            if len(words) < 2:
+                continue
+            color = " ".join(words)
             key = color.lower()
-            if key not in seen and len(color.split()) >= 2:
+            if "grey" in key:
+                color = _RE_GREY.sub("Gray", color)
+                key = color.lower()
+            if key not in seen:
                 seen.add(key)
                 colors.append(color)
     return colors
 
-def _normalize_color(c: str) -> str:
-    """Limpia/normaliza un nombre de color."""
-    x = c.strip()
-    x = re.sub(r"\s+", " ", x)
-    x = re.sub(r"\bGrey\b", "Gray", x, flags=re.I)
-    x = re.sub(r"(?i)^Matte\b", "Matte", x)
-    x = re.sub(r"(?i)\s*PLA\s*$", "", x)
-    x = x.strip(" -–—·.")
-    if x.lower() == "matte" or len(x.split()) < 2:
-        return ""
-    return x
-
-def extract_polymaker_colors(page, model_url: str):
-    """Abre la ficha y extrae título + colores (estricto → relajado → global)."""
-    safe_goto(page, model_url, label="model")
-    page.wait_for_timeout(1200)
-
-    html = page.content()
-    soup = BeautifulSoup(html, "lxml")
-
-    title_node = soup.find(["h1", "title"])
-    title_text = title_node.get_text(strip=True) if title_node else model_url.rsplit("/", 1)[-1]
-    title_text = re.sub(r"\s*\(No Support.*$", "", title_text).strip()
+def _extract_from_poly_block(container):
+    """
+    Bloque Polymaker (el contenedor de _find_poly_container) con XPaths precompiladas:
+    - estricto: anchors a polymaker.com (primeros 80 a/li/p/div/span)
+    - relajado: cualquier texto 'Polymaker ... PLA' (primeros 120 li/p/div/span)
+    Devuelve los estrictos si hay; si no, los relajados (solo entonces se evalúan).
+    """
+    strict = [_text(a) for a in _BLOCK_ANCHORS_XPATH(container)
+              if POLY_DOMAIN_RE.search((a.get("href") or "").strip())]
+    return (_poly_items(strict)
+            or _poly_items(_text(el) for el in _BLOCK_TEXTS_XPATH(container)))
+
+def _finish_model(title_text, colors, model_url: str):
+    """Limpia título (o usa el slug de la URL); los colores llegan ya normalizados."""
+    if title_text is None:
+        title_text = model_url.rsplit("/", 1)[-1]
+    title_text = _RE_NOSUPPORT.sub("", title_text).strip()
+    return title_text, colors
+
+def _parse_model(html: str, model_url: str):
+    """
+    Como parse_model_html, pero indica además si el bloque Polymaker está en el DOM
+    visible (la frase solo dentro de un script, p.ej. __NEXT_DATA__, no cuenta).
+    """
+    doc = lxml.html.fromstring(html, parser=_PARSER)
+
+    title_nodes = _TITLE_XPATH(doc)
+    title_text = _text(title_nodes[0], "") if title_nodes else None
 
     # 1) Bloque estricto → 2) relajado → 3) global
-    colors = _extract_from_poly_block_strict(soup)
+    container = _find_poly_container(doc) if _has_poly_header(html) else None
+    colors = _extract_from_poly_block(container) if container is not None else []
     if not colors:
-        colors = _extract_from_poly_block_relaxed(soup)
+        text = "\n".join(t for t in (t.strip() for t in _BODY_TEXT_XPATH(doc)) if t)
+        colors = _poly_items([text])
+
+    return _finish_model(title_text, colors, model_url), container is not None
+
+def parse_model_html(html: str, model_url: str):
+    """Título + colores a partir del HTML completo de una ficha (estricto → relajado → global)."""
+    return _parse_model(html, model_url)[0]
+
+async def extract_polymaker_colors(page, model_url: str):
+    """
+    Abre la ficha y extrae título + colores. El bloque Polymaker se recorre en el
+    propio navegador (POLY_BLOCK_JS) y solo viajan a Python los textos candidatos.
+    """
+    await safe_goto(page, model_url, label="model")
+    # Sale en cuanto hay texto Polymaker…PLA en el DOM (aunque esté oculto/plegado);
+    # si no llega, se sigue con lo que haya
+    try:
+        await page.wait_for_selector("text=/Polymaker.*PLA/i", state="attached",
+                                     timeout=POLY_WAIT_MS)
+    except PwTimeout:
+        pass
+
+    try:
+        data = await page.evaluate(POLY_BLOCK_JS)
+    except Exception:
+        # p.ej. contexto destruido por una redirección en cliente: parseo clásico
+        return parse_model_html(await page.content(), model_url)
+
+    # 1) Bloque estricto → 2) relajado → 3) global
+    colors = _poly_items(data["strict"]) or _poly_items(data["relaxed"])
     if not colors:
-        text = soup.get_text("\n", strip=True)
-        colors = [m.strip() for m in POLY_LINE_RE.findall(text)]
-
-    # Normalización mínima
-    clean, seen = [], set()
-    for c in colors:
-        x = re.sub(r"\bGrey\b", "Gray", c, flags=re.IGNORECASE)
-        x = re.sub(r"\s+", " ", x).strip(" -–—·.")
-        if len(x.split()) < 2:
-            continue
-        key = x.lower()
-        if key not in seen:
-            seen.add(key)
-            clean.append(x)
+        colors = _poly_items([await page.evaluate(PAGE_TEXT_JS)])
 
-    return title_text, clean
+    return _finish_model(data["title"], colors, model_url)
 
-# ---------- Main ----------
-def main():
-    designer = None
-    # Prioriza argumento CLI; si no, variable de entorno; si no, default Kit Kiln
-    if len(sys.argv) > 1 and sys.argv[1]:
-        designer = sys.argv[1]
-    else:
-        designer = os.getenv("DESIGNER_URL", "https://thangs.com/designer/The%20Kit%20Kiln")
+# ---------- Navegador ----------
+class RateLimiter:
+    """
+    Token bucket mínimo compartido por todas las tareas: reparte turnos cada 1/rate s
+    y solo duerme si se pide antes de tiempo (una ficha lenta no paga espera extra).
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(self.next_slot, now)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+async def launch_browser(p):
+    """Lanza Chromium headless."""
+    return await p.chromium.launch(
+        headless=True,
+        args=["--disable-blink-features=AutomationControlled"]
+    )
+
+def _route_blocked(route):
+    """Aborta recursos pesados (por tipo o por URL); el resto sigue su curso."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or BLOCKED_URL_RE.search(request.url):
+        return route.abort()
+    return route.continue_()
+
+async def new_context(browser):
+    """
+    Contexto único (cookies/estado compartidos) con UA de escritorio. El bloqueo de
+    recursos pesados se registra una vez aquí y aplica a todas sus pestañas: una sola
+    ruta (cada petición pasa una vez por Python) que mira tipo de recurso y URL.
+    """
+    context = await browser.new_context(user_agent=USER_AGENT)
+    await context.route("**/*", _route_blocked)
+    return context
+
+async def scrape_models_browser(context, pending, on_result, limiter):
+    """
+    Fichas que necesitan navegador: todas en vuelo con asyncio.gather; cada una abre
+    su pestaña en el contexto compartido y la cierra al terminar. Un semáforo limita
+    las pestañas abiertas a CONCURRENCY y el RateLimiter marca el ritmo.
+    """
+    n = min(CONCURRENCY, len(pending))
+    print(f"[+] Extrayendo colores con {n} pestañas en paralelo")
+    sem = asyncio.Semaphore(n)
+
+    async def run(i, url):
+        async with sem:
+            await limiter.wait()
+            page = None
+            try:
+                page = await context.new_page()
+                result = await extract_polymaker_colors(page, url)
+            except Exception as e:
+                result = e
+            finally:
+                if page is not None:
+                    await page.close()
+        on_result(i, url, result)
+
+    await asyncio.gather(*(run(i, url) for i, url in pending))
+
+# ---------- Caché ----------
+def _ensure_schema(db):
+    """Crea la tabla si falta y añade fetched_at a cachés de versiones anteriores."""
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS models ("
+        "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, title TEXT, colors TEXT,"
+        " fetched_at INTEGER)"
+    )
+    columns = {row[1] for row in db.execute("PRAGMA table_info(models)")}
+    if "fetched_at" not in columns:
+        db.execute("ALTER TABLE models ADD COLUMN fetched_at INTEGER")
+
+def load_cache(path: Path = CACHE_PATH):
+    """Lee la caché completa: {url: {"etag", "last_modified", "title", "colors", "fetched_at"}}."""
+    if not path.exists():
+        return {}
+    try:
+        db = sqlite3.connect(path)
+        try:
+            with db:
+                _ensure_schema(db)
+            rows = db.execute(
+                "SELECT url, etag, last_modified, title, colors, fetched_at FROM models"
+            ).fetchall()
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        print(f"[WARN] Caché ilegible ({path}): {e}")
+        return {}
+    return {
+        url: {"etag": etag, "last_modified": lm, "title": title,
+              "colors": [c for c in colors.split("; ") if c], "fetched_at": fetched_at}
+        for url, etag, lm, title, colors, fetched_at in rows
+    }
+
+def save_cache(results, validators, path: Path = CACHE_PATH):
+    """Guarda (upsert) los resultados de esta ejecución con sus validadores HTTP."""
+    now = int(time.time())
+    db = sqlite3.connect(path)
+    try:
+        with db:
+            _ensure_schema(db)
+            db.executemany(
+                "INSERT OR REPLACE INTO models"
+                " (url, etag, last_modified, title, colors, fetched_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (url, *validators.get(url, (None, None)), title, "; ".join(colors), now)
+                    for _, url, (title, colors) in results
+                ],
+            )
+    finally:
+        db.close()
+
+def use_fresh_cached(pending, cache, on_result):
+    """
+    Entrega directamente las fichas cacheadas hace menos de CACHE_TTL_S (sin HEAD).
+    Las entradas sin colores no cuentan: pueden ser un fallo pasajero (bloque que no
+    llegó a renderizarse) y se reintentan en cada ejecución.
+    Devuelve (pendientes, urls servidas desde caché).
+    """
+    cutoff = time.time() - CACHE_TTL_S
+    stale, fresh = [], set()
+    for i, url in pending:
+        entry = cache.get(url)
+        if entry and entry["colors"] and (entry["fetched_at"] or 0) >= cutoff:
+            fresh.add(url)
+            on_result(i, url, (entry["title"], entry["colors"]))
+        else:
+            stale.append((i, url))
+    if fresh:
+        print(f"[*] Caché: {len(fresh)} fichas recientes (< {CACHE_TTL_S / 86400:g} días)")
+    return stale, fresh
+
+# ---------- HTTP (sin navegador) ----------
+def _http_client():
+    """Cliente HTTP/2 compartido (una conexión reutilizada para todas las fichas)."""
+    return httpx.AsyncClient(
+        http2=True,
+        follow_redirects=True,
+        timeout=30,
+        headers={"User-Agent": USER_AGENT},
+        limits=httpx.Limits(max_connections=HTTP_CONNECTIONS),
+    )
+
+async def revalidate_cached(pending, cache, on_result, limiter):
+    """
+    HEAD de las fichas que tienen entrada en caché con ETag/Last-Modified y colores;
+    las que conservan los mismos validadores se reutilizan sin descargarlas. Las demás
+    no se consultan (sus validadores salen del GET). Devuelve (pendientes, validadores).
+    """
+    validators = {}
+    candidates = [
+        (i, url) for i, url in pending
+        if (entry := cache.get(url)) and entry["colors"]
+        and (entry["etag"] or entry["last_modified"])
+    ]
+    if not candidates:
+        return list(pending), validators
+
+    sem = asyncio.Semaphore(HTTP_CONNECTIONS)
+    async with _http_client() as client:
+
+        async def head(i, url):
+            try:
+                async with sem:
+                    await limiter.wait()
+                    resp = await client.head(url)
+                resp.raise_for_status()
+            except httpx.HTTPError:
+                return False
+            v = _validators(resp)
+            if v == (None, None):
+                return False
+            validators[url] = v
+            entry = cache.get(url)
+            if entry and (entry["etag"], entry["last_modified"]) == v:
+                on_result(i, url, (entry["title"], entry["colors"]))
+                return True
+            return False
+
+        hits = await asyncio.gather(*(head(i, url) for i, url in candidates))
+
+    reused = {url for (_, url), hit in zip(candidates, hits) if hit}
+    if reused:
+        print(f"[*] Caché: {len(reused)} fichas sin cambios")
+    return [item for item in pending if item[1] not in reused], validators
+
+def _validators(resp):
+    """(ETag, Last-Modified) de una respuesta HTTP."""
+    return resp.headers.get("etag"), resp.headers.get("last-modified")
+
+async def fetch_html(client, url: str):
+    """(HTML, validadores) de una ficha vía HTTP, o (None, None) si la petición falla."""
+    try:
+        resp = await client.get(url)
+        resp.raise_for_status()
+    except httpx.HTTPError:
+        return None, None
+    return resp.text, _validators(resp)
+
+async def fetch_models_http(pending, on_result, limiter, validators):
+    """
+    Descarga las fichas con un único cliente HTTP/2 (conexión reutilizada) y las
+    parsea con lxml. Solo cuentan las que traen el bloque Polymaker en el DOM visible
+    del HTML del servidor; si la primera no lo trae, no se insiste. Confirmado el
+    render en servidor, las fichas que no mencionan Polymaker en absoluto se resuelven
+    aquí (sin colores) en vez de abrirlas en el navegador. Los ETag/Last-Modified de
+    cada GET se anotan en validators. Devuelve los (índice, url) que necesitan navegador.
+    """
+    if not pending:
+        return []
+
+    misses = []
+    # Acotado para que las peticiones en cola no agoten el pool (PoolTimeout)
+    sem = asyncio.Semaphore(HTTP_CONNECTIONS)
+    async with _http_client() as client:
+
+        async def fetch(i, url, probe=False):
+            async with sem:
+                await limiter.wait()
+                html, v = await fetch_html(client, url)
+            if html is None:
+                misses.append((i, url))
+                return False
+            if v != (None, None):
+                validators[url] = v
+            try:
+                result, found = _parse_model(html, url)
+            except Exception as e:
+                result, found = e, True
+            # Sin bloque visible (o solo en el JSON de un script) decide el navegador,
+            # salvo que la ficha no mencione Polymaker en absoluto
+            if not found and (probe or "polymaker" in html.lower()):
+                misses.append((i, url))
+                return False
+            on_result(i, url, result)
+            return True
+
+        # Sondeo: ¿el bloque viene renderizado en servidor?
+        if not await fetch(*pending[0], probe=True):
+            print("[*] El HTML del servidor no trae el bloque Polymaker; se usa Playwright")
+            return list(pending)
+
+        await asyncio.gather(*(fetch(i, url) for i, url in pending[1:]))
+
+    misses.sort()
+    return misses
+
+async def scrape_models(context, urls, on_row):
+    """
+    Extrae título + colores de cada ficha (caché → HTTP/2 + lxml → Playwright para las
+    que no traen el bloque en el HTML del servidor). Cada ficha resuelta se entrega en
+    cuanto llega con on_row(url, título, colores).
+    """
+    total = len(urls)
+    results = []
+    done = 0
+
+    def on_result(i, url, result):
+        nonlocal done
+        done += 1
+        print(f"[{done}/{total}] {url}")
+        if isinstance(result, Exception):
+            print(f"[WARN] {url}: {result}")
+        else:
+            results.append((i, url, result))
+            on_row(url, *result)
+
+    cache = load_cache()
+    pending, fresh = use_fresh_cached(list(enumerate(urls)), cache, on_result)
+    # Un único ritmo (THANGS_RATE) para todas las peticiones al sitio, HTTP o navegador
+    limiter = RateLimiter(RATE)
+    validators = {}
+    try:
+        pending, validators = await revalidate_cached(pending, cache, on_result, limiter)
+        pending = await fetch_models_http(pending, on_result, limiter, validators)
+        print(f"[*] HTTP/caché resolvió {total - len(pending)} fichas; {len(pending)} pasan a Playwright")
+
+        if pending:
+            await scrape_models_browser(context, pending, on_result, limiter)
+    finally:
+        # Aunque la ejecución se corte, lo ya resuelto queda en caché. Las servidas por
+        # TTL no se reescriben: conservan validadores y fecha de descarga
+        try:
+            save_cache([r for r in results if r[1] not in fresh], validators)
+        except sqlite3.Error as e:
+            print(f"[WARN] No se pudo guardar la caché ({CACHE_PATH}): {e}")
+
+# ---------- CSV y resumen ----------
+MODEL_FIELDS = ["model_name", "model_url", "colors"]
+
+# Filas como máximo por escritura a disco (las que ya esperan en la cola van juntas)
+CSV_CHUNK = 50
 
-    rows = []
-    color_to_models = {}
-
-    with sync_playwright() as p:
-        # Navegador + contexto
-        browser = p.chromium.launch(
-            headless=True,
-            args=["--disable-blink-features=AutomationControlled"]
-        )
-        context = browser.new_context(
-            user_agent=("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                        "AppleWebKit/537.36 (KHTML, like Gecko) "
-                        "Chrome/128.0.0.0 Safari/537.36")
-        )
-        page = context.new_page()
-
-        # Bloquea recursos pesados (acelera y evita 'idle' eterno)
-        page.route("**/*", lambda route: (
-            route.abort() if route.request.resource_type in {"image", "media", "font"} else route.continue_()
-        ))
+def _write_chunk(f, chunk: str):
+    f.write(chunk)
+    f.flush()
+
+async def write_rows(path, queue):
+    """
+    Único escritor de models_colors.csv: consume filas de la cola hasta recibir None.
+    Las filas se formatean en memoria y se vuelcan en un hilo (asyncio.to_thread), así
+    el disco no bloquea el bucle de eventos; cada lote se escribe en cuanto la cola se
+    vacía (si el job muere, lo ya extraído queda en disco).
+    """
+    f = await asyncio.to_thread(open, path, "w", newline="", encoding="utf-8")
+    try:
+        buf = io.StringIO(newline="")
+        w = csv.DictWriter(buf, fieldnames=MODEL_FIELDS)
+        w.writeheader()
+        done = False
+        while not done:
+            row = await queue.get()
+            n = 0
+            while row is not None:
+                w.writerow(row)
+                n += 1
+                if n >= CSV_CHUNK or queue.empty():
+                    break
+                row = queue.get_nowait()
+            done = row is None
+
+            chunk = buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            if chunk:
+                await asyncio.to_thread(_write_chunk, f, chunk)
+    finally:
+        await asyncio.to_thread(f.close)
+
+def sort_rows(path):
+    """
+    Reescribe models_colors.csv ordenado por URL: las filas llegan en orden de
+    finalización (distinto en cada ejecución) y así los CSV se pueden comparar.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = sorted(csv.DictReader(f), key=lambda row: row["model_url"])
+    tmp = Path(f"{path}.tmp")
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=MODEL_FIELDS)
+        w.writeheader()
+        w.writerows(rows)
+    os.replace(tmp, path)
+
+def aggregate_colors(path):
+    """
+    Relee models_colors.csv (ya ordenado por URL, ver sort_rows) y agrupa modelos por
+    color fuera del bucle de scraping; cada lista sale en ese mismo orden estable.
+    """
+    color_to_models = defaultdict(list)
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            for c in row["colors"].split("; "):
+                if c:
+                    color_to_models[c].append(row["model_name"])
+    return color_to_models
+
+# ---------- Main ----------
+async def main_async(designer: str):
+    async with async_playwright() as p:
+        browser = await launch_browser(p)
+        # Un solo contexto para descubrimiento y fichas (una pestaña por página)
+        context = await new_context(browser)
+        page = await context.new_page()
 
         print(f"[+] Cargando diseñador/listado: {designer}")
-        urls = discover_model_urls_scroll(page, designer)
+        urls = await discover_model_urls_scroll(page, designer)
 
         if not urls:
-            dump_debug(page, "designer_after_scroll")
-            urls = discover_model_urls_paged(page, designer)
+            urls = await discover_model_urls_paged(page, designer)
+
+        await page.close()
 
         if not urls:
-            print("[X] No se encontraron modelos. Subiendo debug/ para inspeccionar.")
-            browser.close()
+            if DEBUG:
+                print("[X] No se encontraron modelos. Subiendo debug/ para inspeccionar.")
+            else:
+                print("[X] No se encontraron modelos. Relanza con THANGS_DEBUG=1 para guardar debug/.")
+            await browser.close()
             # Archivos vacíos para no fallar el job
             Path("models_colors.csv").write_text("model_name,model_url,colors\n", encoding="utf-8")
             Path("color_counts.csv").write_text("color,count,models\n", encoding="utf-8")
@@ -306,47 +825,51 @@ def main():
             return
 
         print(f"[+] Modelos detectados: {len(urls)}")
-        total = len(urls)
 
-        for i, url in enumerate(urls, 1):
-            print(f"[{i}/{total}] {url}")
-            try:
-                title, colors = extract_polymaker_colors(page, url)
-            except Exception as e:
-                print(f"[WARN] {url}: {e}")
-                time.sleep(0.5)
-                continue
+        # Las fichas resueltas pasan por una cola a un único escritor del CSV
+        queue = asyncio.Queue()
+        writer = asyncio.create_task(write_rows("models_colors.csv", queue))
 
-            rows.append({
+        def on_row(url, title, colors):
+            queue.put_nowait({
                 "model_name": title,
                 "model_url": url,
                 "colors": "; ".join(colors)
             })
-            for c in colors:
-                color_to_models.setdefault(c, []).append(title)
 
-            time.sleep(0.3)
+        try:
+            await scrape_models(context, urls, on_row)
+        finally:
+            queue.put_nowait(None)
+            await writer
+        sort_rows("models_colors.csv")
 
-        browser.close()
+        await browser.close()
 
     # CSVs
-    with open("models_colors.csv", "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=["model_name", "model_url", "colors"])
-        w.writeheader(); w.writerows(rows)
-
-    with open("color_counts.csv", "w", newline="", encoding="utf-8") as f:
+    color_to_models = aggregate_colors("models_colors.csv")
+    items = sorted(color_to_models.items(), key=lambda kv: (-len(kv[1]), kv[0].lower()))
+    with open("color_counts.csv", "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
         w = csv.writer(f); w.writerow(["color", "count", "models"])
-        for color, models in sorted(color_to_models.items(), key=lambda x: (-len(x[1]), x[0].lower())):
-            w.writerow([color, len(models), "; ".join(models)])
+        w.writerows([(color, len(models), "; ".join(models)) for color, models in items])
 
     ensure_loader_exists()
     print("[✓] Listo. Archivos: models_colors.csv, color_counts.csv, thangs_color_matrix_loader.html")
-    if color_to_models:
-        top = sorted(color_to_models.items(), key=lambda x: -len(x[1]))[:10]
+    if items:
         print("Top colores:")
-        for color, models in top:
+        for color, models in items[:10]:
             print(f"  {color}: {len(models)} usos")
 
+def main():
+    designer = None
+    # Prioriza argumento CLI; si no, variable de entorno; si no, default Kit Kiln
+    if len(sys.argv) > 1 and sys.argv[1]:
+        designer = sys.argv[1]
+    else:
+        designer = os.getenv("DESIGNER_URL", "https://thangs.com/designer/The%20Kit%20Kiln")
+
+    asyncio.run(main_async(designer))
+
 def ensure_loader_exists():
     """Escribe el HTML loader reutilizable si no existe (para cargar cualquier CSV)."""
     path = Path("thangs_color_matrix_loader.html")
@@ -354,6 +877,73 @@ def ensure_loader_exists():
         return
     path.write_text(LOADER_HTML, encoding="utf-8")
 
+# ---------- JS de extracción (se ejecuta en la página) ----------
+# Mismo recorrido que _find_poly_container/_extract_from_poly_block, sobre el DOM vivo.
+POLY_BLOCK_JS = r"""() => {
+  const HEADER = /shop the filament we used on the polymaker website/i;
+  const POLY_DOMAIN = /https?:\/\/([a-z0-9\-]+\.)*polymaker\.com\b/i;
+  const POLY = /polymaker/i;
+  // Igual que _NOT_HIDDEN: fuera el texto de scripts/estilos (JSON de __NEXT_DATA__...)
+  const HIDDEN = new Set(["SCRIPT", "STYLE", "TEMPLATE", "NOSCRIPT"]);
+  const visible = { acceptNode: n => n.parentElement && HIDDEN.has(n.parentElement.tagName)
+    ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT };
+  const text = (el, sep) => {
+    const out = [];
+    const w = document.createTreeWalker(el, NodeFilter.SHOW_TEXT, visible);
+    for (let n = w.nextNode(); n; n = w.nextNode()) {
+      const t = n.data.trim();
+      if (t) out.push(t);
+    }
+    return out.join(sep);
+  };
+
+  const titleNode = document.querySelector("h1, title");
+  const result = { title: titleNode ? text(titleNode, "") : null, strict: [], relaxed: [] };
+
+  let header = null;
+  const w = document.createTreeWalker(document.documentElement, NodeFilter.SHOW_TEXT, visible);
+  for (let n = w.nextNode(); n; n = w.nextNode()) {
+    if (HEADER.test(n.data)) { header = n.parentElement; break; }
+  }
+  if (!header) return result;
+
+  const container = header.closest("section, div, article, main") || header;
+  let nStrict = 0, nRelaxed = 0;
+  for (const el of container.querySelectorAll("a, li, p, div, span")) {
+    if (nStrict >= 80 && nRelaxed >= 120) break;
+    if (el.tagName === "A") {
+      if (nStrict < 80) {
+        nStrict++;
+        if (POLY_DOMAIN.test((el.getAttribute("href") || "").trim())) result.strict.push(text(el, " "));
+      }
+      continue;
+    }
+    if (nStrict < 80) nStrict++;
+    if (nRelaxed < 120) {
+      nRelaxed++;
+      // Solo viajan a Python los textos que pueden casar con POLY_ITEM_RE
+      const t = text(el, " ");
+      if (POLY.test(t)) result.relaxed.push(t);
+    }
+  }
+  return result;
+}"""
+
+# Texto visible del body para el fallback global (mismo filtro que _BODY_TEXT_XPATH)
+PAGE_TEXT_JS = r"""() => {
+  const HIDDEN = new Set(["SCRIPT", "STYLE", "TEMPLATE", "NOSCRIPT"]);
+  const visible = { acceptNode: n => n.parentElement && HIDDEN.has(n.parentElement.tagName)
+    ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT };
+  const out = [];
+  if (!document.body) return "";
+  const w = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT, visible);
+  for (let n = w.nextNode(); n; n = w.nextNode()) {
+    const t = n.data.trim();
+    if (t) out.push(t);
+  }
+  return out.join("\n");
+}"""
+
 # ---------- Loader HTML reusable (sin datos hardcodeados) ----------
 LOADER_HTML = r"""<!DOCTYPE html>
 <html lang="es">